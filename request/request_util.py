@@ -1,7 +1,10 @@
 import asyncio
 import atexit
+import concurrent.futures
 import contextvars
 import functools
+import math
+import os
 import sys
 import time
 import typing
@@ -9,14 +12,13 @@ from asyncio import iscoroutinefunction, events
 
 import codecs
 
-import cchardet
 import httpx
 import ujson
 from aiohttp import helpers
-from parsel import Selector
 import aiohttp
 import requests
 from aiohttp import TCPConnector
+from requests.adapters import HTTPAdapter
 
 
 if sys.platform.startswith('win') and sys.version_info >= (3, 8):
@@ -29,12 +31,155 @@ try:
 except ImportError:
     pass
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# faust-cchardet 同样以 cchardet 模块名安装，没有安装时使用 charset_normalizer，都没有安装时默认 utf-8
+try:
+    import cchardet
+except ImportError:
+    cchardet = None
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+# httpx 使用 http2 需要安装 h2: pip install httpx[http2]
+try:
+    import h2
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
 
-async def to_thread(func, *args, **kwargs):
+# 编码检测只需检测 body 开头的一部分就能得到稳定的结果
+CHARDET_SAMPLE = 4096
+
+# 规范中规定只能使用 utf-8 的类型
+FORCED_ENCODINGS = {
+    ("application", "json"): "utf-8",
+    ("application", "rdap"): "utf-8",
+}
+
+# utf-8-sig/utf-16 解码时会去掉 BOM
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+# 同步请求使用的线程池，默认线程池最多只有 32 个线程，并发高时请求会排队
+# 可以通过环境变量 REQUEST_DL_THREADS 调整线程数
+EXECUTOR_WORKERS = int(os.environ.get("REQUEST_DL_THREADS", "128"))
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="reqdl")
+atexit.register(_EXECUTOR.shutdown, wait=False)
+
+
+# 为 True 时 to_thread 默认不复制 contextvars，需要在线程中读取 contextvars 时传 preserve_context=True
+FAST_TO_THREAD = True
+
+
+async def to_thread(func, *args, executor=None, preserve_context=None, **kwargs):
     loop = events.get_running_loop()
-    ctx = contextvars.copy_context()
-    func_call = functools.partial(ctx.run, func, *args, **kwargs)
-    return await loop.run_in_executor(None, func_call)
+    if preserve_context is None:
+        preserve_context = not FAST_TO_THREAD
+
+    if preserve_context:
+        ctx = contextvars.copy_context()
+        # context 中没有任何变量时不需要 ctx.run
+        if ctx:
+            func_call = functools.partial(ctx.run, func, *args, **kwargs)
+            return await loop.run_in_executor(executor or _EXECUTOR, func_call)
+
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+    return await loop.run_in_executor(executor or _EXECUTOR, func, *args)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_mimetype(c_type):
+    # 同一个站点的 Content-Type 基本只有几种，缓存解析结果
+    return helpers.parse_mimetype(c_type)
+
+
+@functools.lru_cache(maxsize=256)
+def is_valid_codec(encoding):
+    # codecs 只缓存查找成功的编码，错误的 charset 每次都会重新查找
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return False
+    return True
+
+
+def detect_encoding(content):
+    if cchardet is not None:
+        return cchardet.detect(content)["encoding"]
+    if charset_normalizer is not None:
+        best = charset_normalizer.from_bytes(content).best()
+        return best.encoding if best else None
+    return None
+
+
+def has_non_finite(obj):
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_non_finite(value) for value in obj)
+    return False
+
+
+def dump_json(json, headers):
+    # orjson 序列化比 requests/httpx/aiohttp 默认使用的标准库 json 快，返回 (body, json, headers)
+    try:
+        body = orjson.dumps(json)
+    except orjson.JSONEncodeError:
+        # 非 str 的 key、Decimal 等 orjson 不支持的类型交给底层库的 json 参数处理
+        return None, json, headers
+
+    # orjson 会把 NaN/Infinity 静默写成 null，这种情况也交给底层库处理（报错或按原样发送）
+    if b"null" in body and has_non_finite(json):
+        return None, json, headers
+
+    if headers is None:
+        return body, None, {"Content-Type": "application/json"}
+
+    # headers 可能是 dict，也可能是 [(key, value)] 列表，Content-Type 判断不区分大小写
+    items = headers.items() if hasattr(headers, "items") else headers
+    if any(key.lower() == "content-type" for key, _ in items):
+        return body, None, headers
+    if hasattr(headers, "items"):
+        return body, None, {**headers, "Content-Type": "application/json"}
+    return body, None, [*headers, ("Content-Type", "application/json")]
+
+
+def running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def current_loop(loop=None):
+    # 返回可以 run_until_complete 的事件循环，asyncio.run 结束后没有当前事件循环时返回 None
+    if loop is None:
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return None
+    return None if loop.is_closed() else loop
+
+
+def async_callable(callable_fun):
+    # 提前判断是否为协程函数，避免每次调用 run_function 时都做判断
+    if callable_fun is None or iscoroutinefunction(callable_fun):
+        return callable_fun
+    return functools.partial(to_thread, callable_fun)
 
 
 async def run_function(callable_fun,  *args, **kwargs) -> typing.Any:
@@ -44,21 +189,88 @@ async def run_function(callable_fun,  *args, **kwargs) -> typing.Any:
         return await to_thread(callable_fun, *args, **kwargs)
 
 
+# 按事件循环共享 aiohttp session，所有 AiohttpDownloader 实例共用同一个连接池
+# 值为 (session, guard)，session 持有事件循环的引用，条目在 guard 关闭 session 时删除，
+# 没有经过 shutdown_asyncgens 就关闭的事件循环，在下次创建 session 时删除
+_AIOHTTP_SESSIONS = {}
+
+
+async def _session_guard(loop, session):
+    # 事件循环关闭前（如 asyncio.run 结束时）loop.shutdown_asyncgens 会关闭这个生成器，从而关闭 session
+    try:
+        yield
+    finally:
+        entry = _AIOHTTP_SESSIONS.get(loop)
+        if entry is not None and entry[0] is session:
+            del _AIOHTTP_SESSIONS[loop]
+        if not session.closed:
+            await session.close()
+
+
+async def shared_aiohttp_session(loop):
+    entry = _AIOHTTP_SESSIONS.get(loop)
+    if entry is not None and not entry[0].closed:
+        return entry[0]
+
+    # 已关闭的事件循环上的 session 不能再使用，直接删除
+    for closed_loop in [item for item in _AIOHTTP_SESSIONS.keys() if item.is_closed()]:
+        _AIOHTTP_SESSIONS.pop(closed_loop, None)
+
+    connector = TCPConnector(
+        limit=1000, limit_per_host=100, keepalive_timeout=30, ttl_dns_cache=300, enable_cleanup_closed=True,
+        ssl=False
+    )
+    session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+    guard = _session_guard(loop, session)
+    # 在 yield 之前没有 await，这里不会切换任务，gather 并发调用也只会创建一个 session
+    _AIOHTTP_SESSIONS[loop] = (session, guard)
+    await guard.__anext__()
+    return session
+
+
+def close_aiohttp_sessions():
+    # 没有通过 asyncio.run 关闭的事件循环，在退出时关闭其 session
+    for loop, (session, guard) in list(_AIOHTTP_SESSIONS.items()):
+        if session.closed or loop.is_closed() or loop.is_running():
+            continue
+        loop.run_until_complete(guard.aclose())
+    _AIOHTTP_SESSIONS.clear()
+
+
+atexit.register(close_aiohttp_sessions)
+
+
 class Request:
-    method = None
-    url = None
+    _fields = (
+        "method", "url", "params", "data", "headers", "cookies", "files", "auth", "timeout", "allow_redirects",
+        "proxies", "proxy", "hooks", "stream", "verify", "cert", "ssl", "json", "content", "session", "read_body",
+    )
+    # _extra 保存其他参数（如 httpx 的 extensions、aiohttp 的 max_redirects），由 fetch 的 **kwargs 传给底层库
+    __slots__ = _fields + ("_extra",)
 
     def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
+        for name in self._fields:
+            setattr(self, name, kwargs.pop(name, None))
+        self._extra = kwargs
 
     def __repr__(self):
         return f"<{self.method} {self.url}>"
 
     def get_http_kwargs(self):
-        return self.__dict__.copy()
+        http_kwargs = {}
+        for name in self._fields:
+            value = getattr(self, name)
+            if value is not None:
+                http_kwargs[name] = value
+        http_kwargs.update(self._extra)
+        return http_kwargs
 
 
 class Response:
+    __slots__ = (
+        "url", "_encoding", "headers", "cookies", "history", "status", "_content", "_text", "_selector"
+    )
+
     def __init__(
         self,
         url: str = "",
@@ -71,36 +283,76 @@ class Response:
         status: int = -1,
     ):
         self.url = url
-        self.encoding = encoding
+        self._encoding = encoding
         self.headers = headers
         self.cookies = cookies
         self.history = history
         self.status = status
         self._content = content
-        self.ok = 1 if self.status < 300 else 0
+        self._text = None
+        self._selector = None
+
+    @property
+    def ok(self):
+        return self.status < 300
 
     @property
     def content(self):
         return self._content
 
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._text = None
+        self._selector = None
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        self._encoding = value
+        self._text = None
+        self._selector = None
+
     @property
     def text(self):
+        if self._content is None:
+            return None
         if not self._content:
-            return self._content
+            return ""
 
-        if not self.encoding:
-            self.encoding = self.get_encoding()
+        if self._text is None:
+            if not self._encoding:
+                self._encoding = self.get_encoding()
+            self._text = self._content.decode(self._encoding, errors='replace')
 
-        return self._content.decode(self.encoding, errors='replace')
+        return self._text
 
     def json(self, *args, **kwargs):
-        return ujson.loads(self.text, *args, **kwargs)
+        if args or kwargs or orjson is None:
+            return ujson.loads(self.text, *args, **kwargs)
+
+        if not self._encoding:
+            self._encoding = self.get_encoding()
+
+        # 编码为 utf-8 且没有 BOM 时，orjson 直接解析 bytes，省去 decode 成 str 的开销
+        content = self._content
+        if content and codecs.lookup(self._encoding).name == "utf-8" and not content.startswith(codecs.BOM_UTF8):
+            return orjson.loads(content)
+        return orjson.loads(self.text)
 
     @property
     def selector(self):
-        return Selector(self.text)
+        if self._selector is None:
+            # parsel/lxml 只在解析 html 时才用到，延迟导入以加快启动速度
+            from parsel import Selector
+            self._selector = Selector(self.text)
+        return self._selector
 
     def xpath(self, xpath_str):
+        # parsel 会缓存编译后的 xpath 表达式
         return self.selector.xpath(xpath_str)
 
     def re(self, re_str):
@@ -111,40 +363,49 @@ class Response:
 
     def get_encoding(self) -> str:
         c_type = self.headers.get("Content-Type", "").lower()
-        mimetype = helpers.parse_mimetype(c_type)
+        if "json" in c_type and "charset" not in c_type:
+            return "utf-8"
+
+        mimetype = parse_mimetype(c_type)
 
         encoding = mimetype.parameters.get("charset")
+        if encoding and is_valid_codec(encoding):
+            return encoding
+
+        encoding = FORCED_ENCODINGS.get((mimetype.type, mimetype.subtype))
         if encoding:
-            try:
-                codecs.lookup(encoding)
-            except LookupError:
-                encoding = None
-        if not encoding:
-            if mimetype.type == "application" and (mimetype.subtype == "json" or mimetype.subtype == "rdap"):
-                encoding = "utf-8"
-            elif self._content is None:
-                raise RuntimeError("Cannot guess the encoding of " "a not yet read body")
-            else:
-                encoding = cchardet.detect(self._content)["encoding"]
-        if not encoding:
-            encoding = "utf-8"
+            return encoding
+
+        if self._content is None:
+            raise RuntimeError("Cannot guess the encoding of " "a not yet read body")
 
-        return encoding
+        for bom, bom_encoding in BOM_ENCODINGS:
+            if self._content.startswith(bom):
+                return bom_encoding
+
+        return detect_encoding(self._content[:CHARDET_SAMPLE]) or "utf-8"
 
     def __repr__(self):
         return f"<Response [{self.status}]>"
 
 
 class RequestDownloader:
-    def __init__(self, session=None, proxy_fun=None):
+    def __init__(self, session=None, proxy_fun=None, executor=None):
         self.downloader_cls = requests
         self.proxy_fun = proxy_fun
+        # 为 None 时使用模块共享的线程池
+        self.executor = executor
 
         if session:
             self.default_session = session
         else:
             self.default_session = requests.Session()
             self.default_session.trust_env = False
+            # 连接池大小不小于线程数，否则并发超过连接池时 urllib3 会丢弃 keep-alive 连接
+            pool_size = max(EXECUTOR_WORKERS, getattr(executor, "_max_workers", 0))
+            adapter = HTTPAdapter(pool_connections=100, pool_maxsize=pool_size)
+            self.default_session.mount("http://", adapter)
+            self.default_session.mount("https://", adapter)
 
     @staticmethod
     def get_response(resp):
@@ -157,65 +418,181 @@ class RequestDownloader:
             history=resp.history
         )
 
-    @staticmethod
-    def get_kwargs(kwargs):
-        kwargs.pop("session", None)
-        _kwargs = kwargs.pop("kwargs")
-
-        new_kwargs = {**kwargs, **_kwargs}
-        new_kwargs.pop("self")
-        new_kwargs.pop("session", None)
-        return new_kwargs
-
     def fetch(self, url, method="GET", params=None, data=None, headers=None, cookies=None, files=None, auth=None,
               timeout=None, allow_redirects=True, proxies=None, hooks=None, stream=None, verify=None, cert=None,
               json=None, session=None, **kwargs):
+        if json is not None and data is None and orjson is not None:
+            data, json, headers = dump_json(json, headers)
+
+        req = {"method": method, "url": url, "allow_redirects": allow_redirects}
+        if params is not None:
+            req["params"] = params
+        if data is not None:
+            req["data"] = data
+        if headers is not None:
+            req["headers"] = headers
+        if cookies is not None:
+            req["cookies"] = cookies
+        if files is not None:
+            req["files"] = files
+        if auth is not None:
+            req["auth"] = auth
+        if timeout is not None:
+            req["timeout"] = timeout
+        if proxies is not None:
+            req["proxies"] = proxies
+        if hooks is not None:
+            req["hooks"] = hooks
+        if stream is not None:
+            req["stream"] = stream
+        if verify is not None:
+            req["verify"] = verify
+        if cert is not None:
+            req["cert"] = cert
+        if json is not None:
+            req["json"] = json
+        req.update(kwargs)
 
-        _kwargs = locals().copy()
-        _kwargs.pop("self")
-        _kwargs.pop("kwargs")
-        _kwargs.pop("session")
         if not session:
             session = self.default_session
 
-        resp = session.request(**_kwargs)
+        resp = session.request(**req)
         return self.get_response(resp)
 
     async def async_fetch(self, url, method="GET", params=None, data=None, headers=None, cookies=None, files=None,
                           auth=None, timeout=None, allow_redirects=True, proxies=None, hooks=None, stream=None,
                           verify=None, cert=None, json=None, session=None, **kwargs):
-        _kwargs = locals().copy()
-        _kwargs.pop("self")
-        _kwargs.pop("kwargs")
-        return await run_function(self.fetch, **_kwargs, **kwargs)
+        return await to_thread(
+            self.fetch, url, executor=self.executor, method=method, params=params, data=data, headers=headers,
+            cookies=cookies, files=files, auth=auth, timeout=timeout, allow_redirects=allow_redirects,
+            proxies=proxies, hooks=hooks, stream=stream, verify=verify, cert=cert, json=json, session=session,
+            **kwargs
+        )
 
 
 class HttpxDownloader:
-    def __init__(self, session=None, proxy_fun=None, loop=None):
+    # 代理池轮换时代理数量不固定，超过上限后关闭最久未使用的 client
+    max_proxy_sessions = 64
+
+    def __init__(self, session=None, proxy_fun=None, loop=None, http2=None):
         self.downloader_cls = httpx
+        # 默认在安装了 h2 时开启 http2
+        self.http2 = HAS_H2 if http2 is None else http2
 
         self.proxy_fun = proxy_fun
+        self._get_proxy = async_callable(proxy_fun)
+
+        # 每个代理单独创建一个 client，避免修改 client.proxies 导致连接池失效
+        self._proxy_sessions = {}
+        self._async_proxy_sessions = {}
+        # 每个 client 正在进行的请求数，有请求的 client 不会被淘汰
+        self._in_flight = {}
+        # 保存关闭 client 的 task，asyncio 只持有 task 的弱引用
+        self._closing_tasks = set()
 
         if session:
             self.default_session = session
         else:
-            self.default_session = httpx.Client(verify=False, http2=False, trust_env=False)
-            self.default_async_session = httpx.AsyncClient(verify=False, http2=False, trust_env=False)
+            self.default_session = httpx.Client(**self.client_kwargs())
+            self.default_async_session = httpx.AsyncClient(**self.client_kwargs())
 
-        self.loop = loop if loop else asyncio.get_event_loop()
+        self.loop = loop
 
         atexit.register(self.close)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def client_kwargs(self, **kwargs):
+        client_kwargs = dict(
+            verify=False,
+            http2=self.http2,
+            trust_env=False,
+            limits=self.limits(),
+            timeout=httpx.Timeout(30.0),
+        )
+        client_kwargs.update(kwargs)
+        return client_kwargs
+
+    @staticmethod
+    def limits():
+        return httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30.0)
+
+    def proxy_client_kwargs(self, proxies, is_async=False):
+        # httpx 0.28 移除了 proxies 参数，字符串使用 proxy，按协议区分的 dict 使用 mounts
+        if isinstance(proxies, str):
+            return self.client_kwargs(proxy=proxies)
+
+        # mounts 中的 transport 不会继承 client 的 verify/http2/limits 配置
+        transport_cls = httpx.AsyncHTTPTransport if is_async else httpx.HTTPTransport
+        mounts = {}
+        for pattern, proxy in proxies.items():
+            # 兼容 requests 风格的 {"http": ..., "https": ...}
+            if "://" not in pattern:
+                pattern = f"{pattern}://"
+            if proxy:
+                mounts[pattern] = transport_cls(proxy=proxy, verify=False, http2=self.http2, limits=self.limits())
+            else:
+                mounts[pattern] = None
+        return self.client_kwargs(mounts=mounts)
+
     def run_in_async(self, func, *args, **kwargs):
-        return self.loop.run_until_complete(func(*args, **kwargs))
+        if running_loop() is not None:
+            raise RuntimeError("Cannot run synchronously inside a running event loop, use async_fetch instead")
+        loop = current_loop(self.loop)
+        if loop is None:
+            return asyncio.run(func(*args, **kwargs))
+        return loop.run_until_complete(func(*args, **kwargs))
+
+    def get_session(self, proxies=None, is_async=False):
+        if not proxies:
+            return self.default_async_session if is_async else self.default_session
+
+        sessions = self._async_proxy_sessions if is_async else self._proxy_sessions
+        key = proxies if isinstance(proxies, str) else tuple(sorted(proxies.items()))
+        session = sessions.pop(key, None)
+        if session is None:
+            if len(sessions) >= self.max_proxy_sessions:
+                self.evict_session(sessions, is_async)
+            client_cls = httpx.AsyncClient if is_async else httpx.Client
+            session = client_cls(**self.proxy_client_kwargs(proxies, is_async))
+        # 重新插入到末尾，dict 的顺序即为最近使用顺序
+        sessions[key] = session
+        return session
+
+    def evict_session(self, sessions, is_async=False):
+        # 关闭最久未使用且没有请求的 client，全部都在使用时暂时超出上限
+        for key, session in sessions.items():
+            if not self._in_flight.get(session):
+                break
+        else:
+            return
+        del sessions[key]
+        if is_async:
+            task = asyncio.ensure_future(session.aclose())
+            self._closing_tasks.add(task)
+            task.add_done_callback(self._closing_tasks.discard)
+        else:
+            session.close()
+
+    def acquire_session(self, session):
+        self._in_flight[session] = self._in_flight.get(session, 0) + 1
+
+    def release_session(self, session):
+        count = self._in_flight.pop(session) - 1
+        if count:
+            self._in_flight[session] = count
 
     def close(self):
         if self.default_session:
             self.default_session.close()
-            self.run_in_async(self.default_async_session.aclose)
+            for session in self._proxy_sessions.values():
+                session.close()
+            # 事件循环已经关闭时，异步 client 的连接已随之释放，不需要再 aclose
+            if not running_loop() and current_loop(self.loop) is not None:
+                self.run_in_async(self.default_async_session.aclose)
+                for session in self._async_proxy_sessions.values():
+                    self.run_in_async(session.aclose)
 
     @staticmethod
     def get_response(resp):
@@ -228,56 +605,87 @@ class HttpxDownloader:
             history=resp.history
         )
 
-    @staticmethod
-    def get_kwargs(kwargs):
-        kwargs.pop("session", None)
-        _kwargs = kwargs.pop("kwargs")
-
-        new_kwargs = {**kwargs, **_kwargs}
-        new_kwargs.pop("self")
-        new_kwargs.pop("session", None)
-        new_kwargs.pop("proxies", None)
-        return new_kwargs
-
     def fetch(self, url, method="GET", params=None, data=None, headers=None, cookies=None, files=None, auth=None,
               timeout=None, allow_redirects=True, content=None, proxies=None, json=None, session=None, **kwargs):
-        _kwargs = self.get_kwargs(locals().copy())
+        if json is not None and content is None and orjson is not None:
+            content, json, headers = dump_json(json, headers)
+
+        # httpx 0.20 起使用 follow_redirects 代替 allow_redirects
+        req = {"method": method, "url": url, "follow_redirects": allow_redirects}
+        if params is not None:
+            req["params"] = params
+        if data is not None:
+            req["data"] = data
+        if headers is not None:
+            req["headers"] = headers
+        if cookies is not None:
+            req["cookies"] = cookies
+        if files is not None:
+            req["files"] = files
+        if auth is not None:
+            req["auth"] = auth
+        if timeout is not None:
+            req["timeout"] = timeout
+        if content is not None:
+            req["content"] = content
+        if json is not None:
+            req["json"] = json
+        req.update(kwargs)
 
         if not session:
-            session = self.default_session
+            session = self.get_session(proxies)
 
-        if proxies:
-            session.proxies = proxies
-        else:
-            session.proxies = {"https": None, "http": None}
-
-        resp = session.request(**kwargs)
+        self.acquire_session(session)
+        try:
+            resp = session.request(**req)
+        finally:
+            self.release_session(session)
         return self.get_response(resp)
 
     async def async_fetch(self, url, method="GET", params=None, data=None, headers=None, cookies=None, files=None,
                           auth=None, timeout=None, allow_redirects=True, content=None, proxies=None, json=None,
                           session=None, **kwargs):
-        _kwargs = self.get_kwargs(locals().copy())
+        if json is not None and content is None and orjson is not None:
+            content, json, headers = dump_json(json, headers)
+
+        # httpx 0.20 起使用 follow_redirects 代替 allow_redirects
+        req = {"method": method, "url": url, "follow_redirects": allow_redirects}
+        if params is not None:
+            req["params"] = params
+        if data is not None:
+            req["data"] = data
+        if headers is not None:
+            req["headers"] = headers
+        if cookies is not None:
+            req["cookies"] = cookies
+        if files is not None:
+            req["files"] = files
+        if auth is not None:
+            req["auth"] = auth
+        if timeout is not None:
+            req["timeout"] = timeout
+        if content is not None:
+            req["content"] = content
+        if json is not None:
+            req["json"] = json
+        req.update(kwargs)
 
         if not session:
-            session = self.default_async_session
-
-        if proxies is not None:
-            session.proxies = proxies
-        else:
-            if self.proxy_fun:
-                session.proxies = await run_function(self.proxy_fun)
-            else:
-                session.proxies = {"https": None, "http": None}
-
-        resp = await session.request(**_kwargs)
+            if proxies is None and self._get_proxy:
+                proxies = await self._get_proxy()
+            session = self.get_session(proxies, is_async=True)
+
+        self.acquire_session(session)
+        try:
+            resp = await session.request(**req)
+        finally:
+            self.release_session(session)
         return self.get_response(resp)
 
 
 class AiohttpDownloader:
     def __init__(self, session=None, proxy_fun=None, loop=None):
         self.downloader_cls = aiohttp
-        self.tc = None
 
         if session:
             self.default_session = session
@@ -285,16 +693,17 @@ class AiohttpDownloader:
             self.default_session = None
 
         self.proxy_fun = proxy_fun
+        self._get_proxy = async_callable(proxy_fun)
 
-        self.loop = loop if loop else asyncio.get_event_loop()
+        self.loop = loop
 
         atexit.register(self.close)
 
     @staticmethod
-    async def get_response(resp):
+    async def get_response(resp, read_body=True):
         return Response(
             url=str(resp.url),
-            content=await resp.read(),
+            content=await resp.read() if read_body else None,
             status=resp.status,
             cookies=resp.cookies,
             headers=resp.headers,
@@ -302,49 +711,68 @@ class AiohttpDownloader:
         )
 
     def run_in_async(self, func, *args, **kwargs):
-        return self.loop.run_until_complete(func(*args, **kwargs))
-
-    @staticmethod
-    def get_kwargs(kwargs):
-        kwargs.pop("session", None)
-        _kwargs = kwargs.pop("kwargs")
-
-        new_kwargs = {**kwargs, **_kwargs}
-        new_kwargs.pop("self")
-        new_kwargs.pop("session", None)
-        return new_kwargs
+        if running_loop() is not None:
+            raise RuntimeError("Cannot run synchronously inside a running event loop, use async_fetch instead")
+        loop = current_loop(self.loop)
+        if loop is None:
+            return asyncio.run(func(*args, **kwargs))
+        return loop.run_until_complete(func(*args, **kwargs))
 
     async def get_session(self):
-        if self.default_session:
-            return self.default_session
-        else:
-            jar = aiohttp.DummyCookieJar()
-            self.tc = TCPConnector(limit=1000, force_close=True, enable_cleanup_closed=True, ssl=False)
-            self.default_session = aiohttp.ClientSession(connector=self.tc, cookie_jar=jar)
+        if self.default_session is not None:
             return self.default_session
+        return await shared_aiohttp_session(events.get_running_loop())
 
     def close(self):
+        # 共享的 session 由 close_aiohttp_sessions 统一关闭
         if self.default_session:
-            self.run_in_async(self.default_session.close)
-            self.tc.close()
+            if not running_loop() and current_loop(self.loop) is not None:
+                self.run_in_async(self.default_session.close)
 
     def fetch(self, url, method="GET", headers=None, cookies=None, allow_redirects=True, params=None, data=None,
-              json=None, auth=None, timeout=None, ssl=None, proxy=None, session=None, **kwargs):
-        _kwargs = self.get_kwargs(locals().copy())
-        return self.run_in_async(self.async_fetch, **_kwargs)
+              json=None, auth=None, timeout=None, ssl=None, proxy=None, session=None, read_body=True, **kwargs):
+        return self.run_in_async(
+            self.async_fetch, url, method=method, headers=headers, cookies=cookies, allow_redirects=allow_redirects,
+            params=params, data=data, json=json, auth=auth, timeout=timeout, ssl=ssl, proxy=proxy, session=session,
+            read_body=read_body, **kwargs
+        )
 
     async def async_fetch(self, url, method="GET", headers=None, cookies=None, allow_redirects=True, params=None,
-                          data=None, json=None, auth=None, timeout=None, ssl=None, proxy=None, session=None, **kwargs):
-        _kwargs = self.get_kwargs(locals().copy())
+                          data=None, json=None, auth=None, timeout=None, ssl=None, proxy=None, session=None,
+                          read_body=True, **kwargs):
+        # read_body=False 时不读取响应体，只需要状态码和响应头时使用
+        # 注意：响应体未读完时 aiohttp 会直接关闭连接而不是放回连接池，每次请求都要重新建立 TCP/TLS 连接，
+        # 同一个 host 的大量请求应保持默认的 read_body=True 以复用连接
+        if json is not None and data is None and orjson is not None:
+            data, json, headers = dump_json(json, headers)
+
+        req = {"method": method, "url": url, "allow_redirects": allow_redirects}
+        if headers is not None:
+            req["headers"] = headers
+        if cookies is not None:
+            req["cookies"] = cookies
+        if params is not None:
+            req["params"] = params
+        if data is not None:
+            req["data"] = data
+        if json is not None:
+            req["json"] = json
+        if auth is not None:
+            req["auth"] = auth
+        if timeout is not None:
+            req["timeout"] = timeout
+        if ssl is not None:
+            req["ssl"] = ssl
+        if proxy is None and self._get_proxy:
+            proxy = await self._get_proxy()
+        if proxy:
+            req["proxy"] = proxy
+        req.update(kwargs)
 
         if not session:
             session = await self.get_session()
 
-        if proxy is not None and self.proxy_fun:
-            _kwargs["proxy"] = await run_function(self.proxy_fun)
-
-        async with aiohttp.ClientSession() as client:
-            async with client.request(**_kwargs) as resp:
-                return await self.get_response(resp)
+        async with session.request(**req) as resp:
+            return await self.get_response(resp, read_body)
 
 